@@ -1,77 +1,112 @@
 #!/usr/bin/env python3
 """Generate and post a combined coverage comment to a PR."""
 
+import hashlib
+import http.client
 import json
 import os
 import re
-import subprocess
 import sys
 from pathlib import Path
 
+# orjson is optional and only speeds up parsing GitHub API responses
+try:
+    from orjson import loads as json_loads
+except ImportError:
+    from json import loads as json_loads
+
+
+# LCOV summary record prefixes and the counter each one sets
+LCOV_COUNTERS = {
+    'LF': 'lines_found',
+    'LH': 'lines_hit',
+    'FNF': 'funcs_found',
+    'FNH': 'funcs_hit',
+    'BRF': 'branches_found',
+    'BRH': 'branches_hit',
+}
+
+
+def with_percentages(counters: dict[str, int]) -> dict[str, float]:
+    """Return hit/found counters together with their coverage percentages."""
+    lines_found = counters['lines_found']
+    funcs_found = counters['funcs_found']
+    branches_found = counters['branches_found']
+    return {
+        'lines': (counters['lines_hit'] / lines_found * 100) if lines_found > 0 else 0,
+        'funcs': (counters['funcs_hit'] / funcs_found * 100) if funcs_found > 0 else 0,
+        'branches': (counters['branches_hit'] / branches_found * 100) if branches_found > 0 else 0,
+        **counters,
+    }
+
 
 def parse_lcov(lcov_file: Path) -> dict[str, dict[str, float]]:
     """Parse an LCOV file and return coverage statistics."""
     if not lcov_file.exists():
         return {}
 
-    content = lcov_file.read_text()
     files = {}
     current_file = None
-    lines_found = 0
-    lines_hit = 0
-    funcs_found = 0
-    funcs_hit = 0
-    branches_found = 0
-    branches_hit = 0
-
-    for line in content.strip().split('\n'):
-        if line.startswith('SF:'):
-            current_file = line[3:]
-            lines_found = lines_hit = 0
-            funcs_found = funcs_hit = 0
-            branches_found = branches_hit = 0
-        elif line.startswith('LF:'):
-            lines_found = int(line[3:])
-        elif line.startswith('LH:'):
-            lines_hit = int(line[3:])
-        elif line.startswith('FNF:'):
-            funcs_found = int(line[4:])
-        elif line.startswith('FNH:'):
-            funcs_hit = int(line[4:])
-        elif line.startswith('BRF:'):
-            branches_found = int(line[4:])
-        elif line.startswith('BRH:'):
-            branches_hit = int(line[4:])
-        elif line == 'end_of_record' and current_file:
-            files[current_file] = {
-                'lines': (lines_hit / lines_found * 100) if lines_found > 0 else 0,
-                'funcs': (funcs_hit / funcs_found * 100) if funcs_found > 0 else 0,
-                'branches': (branches_hit / branches_found * 100) if branches_found > 0 else 0,
-                'lines_hit': lines_hit,
-                'lines_found': lines_found,
-                'funcs_hit': funcs_hit,
-                'funcs_found': funcs_found,
-                'branches_hit': branches_hit,
-                'branches_found': branches_found,
-            }
+    counters = dict.fromkeys(LCOV_COUNTERS.values(), 0)
+
+    # Iterate the file handle so large reports are never held in memory at once
+    with lcov_file.open('r', buffering=1 << 20) as fh:
+        for line in fh:
+            prefix, _, value = line.rstrip('\n').partition(':')
+            counter = LCOV_COUNTERS.get(prefix)
+            if counter:
+                counters[counter] = int(value)
+            elif prefix == 'SF':
+                current_file = value
+                counters = dict.fromkeys(LCOV_COUNTERS.values(), 0)
+            elif prefix == 'end_of_record' and current_file:
+                files[current_file] = with_percentages(counters)
 
     return files
 
 
-def calculate_totals(files: dict[str, dict[str, float]]) -> dict[str, float]:
-    """Calculate total coverage from files."""
-    total_lines_hit = sum(f['lines_hit'] for f in files.values())
-    total_lines_found = sum(f['lines_found'] for f in files.values())
-    total_funcs_hit = sum(f['funcs_hit'] for f in files.values())
-    total_funcs_found = sum(f['funcs_found'] for f in files.values())
-    total_branches_hit = sum(f['branches_hit'] for f in files.values())
-    total_branches_found = sum(f['branches_found'] for f in files.values())
+# Per-file counters summed by calculate_totals
+TOTAL_COUNTERS = (
+    'lines_hit', 'lines_found', 'funcs_hit', 'funcs_found', 'branches_hit', 'branches_found',
+)
 
-    return {
-        'lines': (total_lines_hit / total_lines_found * 100) if total_lines_found > 0 else 0,
-        'funcs': (total_funcs_hit / total_funcs_found * 100) if total_funcs_found > 0 else 0,
-        'branches': (total_branches_hit / total_branches_found * 100) if total_branches_found > 0 else 0,
-    }
+
+def calculate_totals(files: dict[str, dict[str, float]]) -> dict[str, float]:
+    """Calculate total coverage from files.
+
+    The result has the same shape as a per-file entry: percentages plus the
+    summed hit/found counters, so totals can themselves be combined.
+    """
+    total_lines_hit = total_lines_found = 0
+    total_funcs_hit = total_funcs_found = 0
+    total_branches_hit = total_branches_found = 0
+
+    # Accumulate every counter in a single pass over the files
+    for f in files.values():
+        total_lines_hit += f['lines_hit']
+        total_lines_found += f['lines_found']
+        total_funcs_hit += f['funcs_hit']
+        total_funcs_found += f['funcs_found']
+        total_branches_hit += f['branches_hit']
+        total_branches_found += f['branches_found']
+
+    return with_percentages({
+        'lines_hit': total_lines_hit,
+        'lines_found': total_lines_found,
+        'funcs_hit': total_funcs_hit,
+        'funcs_found': total_funcs_found,
+        'branches_hit': total_branches_hit,
+        'branches_found': total_branches_found,
+    })
+
+
+def format_file_rows(files: dict[str, dict[str, float]]) -> str:
+    """Format the per-file table rows, sorted by path."""
+    # rsplit avoids building a Path object per file just to take its name
+    return ''.join(
+        f"| {file.rsplit('/', 1)[-1]} | {stats['lines']:.2f}% | {stats['funcs']:.2f}% | {stats['branches']:.2f}% |\n"
+        for file, stats in sorted(files.items())
+    )
 
 
 def format_coverage_comment(backend_files: dict, frontend_files: dict) -> str:
@@ -79,84 +114,205 @@ def format_coverage_comment(backend_files: dict, frontend_files: dict) -> str:
     backend_totals = calculate_totals(backend_files)
     frontend_totals = calculate_totals(frontend_files)
 
-    # Combine for overall
-    all_files = {**backend_files, **frontend_files}
-    overall_totals = calculate_totals(all_files)
+    # Combine for overall by adding the section counters
+    overall_totals = with_percentages(
+        {k: backend_totals[k] + frontend_totals[k] for k in TOTAL_COUNTERS}
+    )
 
-    comment = "## Code Coverage Report\n\n"
+    parts = ["## Code Coverage Report\n\n"]
 
     # Total section
-    comment += "### Total\n\n"
-    comment += f"| Lines | Functions | Branches |\n"
-    comment += f"|-------|-----------|----------|\n"
-    comment += f"| {overall_totals['lines']:.2f}% | {overall_totals['funcs']:.2f}% | {overall_totals['branches']:.2f}% |\n\n"
+    parts.append("### Total\n\n")
+    parts.append("| Lines | Functions | Branches |\n")
+    parts.append("|-------|-----------|----------|\n")
+    parts.append(f"| {overall_totals['lines']:.2f}% | {overall_totals['funcs']:.2f}% | {overall_totals['branches']:.2f}% |\n\n")
 
     # Backend section with file breakdown
-    comment += "### Backend\n\n"
-    comment += "| File | Lines | Functions | Branches |\n"
-    comment += "|------|-------|-----------|----------|\n"
-    comment += f"| **Total** | **{backend_totals['lines']:.2f}%** | **{backend_totals['funcs']:.2f}%** | **{backend_totals['branches']:.2f}%** |\n"
+    parts.append("### Backend\n\n")
+    parts.append("| File | Lines | Functions | Branches |\n")
+    parts.append("|------|-------|-----------|----------|\n")
+    parts.append(f"| **Total** | **{backend_totals['lines']:.2f}%** | **{backend_totals['funcs']:.2f}%** | **{backend_totals['branches']:.2f}%** |\n")
 
     if backend_files:
-        for file, stats in sorted(backend_files.items()):
-            filename = Path(file).name
-            comment += f"| {filename} | {stats['lines']:.2f}% | {stats['funcs']:.2f}% | {stats['branches']:.2f}% |\n"
-        comment += "\n"
+        parts.append(format_file_rows(backend_files))
+        parts.append("\n")
 
     # Frontend section with file breakdown
-    comment += "### Frontend\n\n"
-    comment += "| File | Lines | Functions | Branches |\n"
-    comment += "|------|-------|-----------|----------|\n"
-    comment += f"| **Total** | **{frontend_totals['lines']:.2f}%** | **{frontend_totals['funcs']:.2f}%** | **{frontend_totals['branches']:.2f}%** |\n"
+    parts.append("### Frontend\n\n")
+    parts.append("| File | Lines | Functions | Branches |\n")
+    parts.append("|------|-------|-----------|----------|\n")
+    parts.append(f"| **Total** | **{frontend_totals['lines']:.2f}%** | **{frontend_totals['funcs']:.2f}%** | **{frontend_totals['branches']:.2f}%** |\n")
 
     if frontend_files:
-        for file, stats in sorted(frontend_files.items()):
-            filename = Path(file).name
-            comment += f"| {filename} | {stats['lines']:.2f}% | {stats['funcs']:.2f}% | {stats['branches']:.2f}% |\n"
+        parts.append(format_file_rows(frontend_files))
 
-    return comment
+    return ''.join(parts)
+
+
+def _etag_cache_path() -> Path | None:
+    """Return the location of the comment-list ETag cache.
+
+    The cache only lives in the Actions runner's temp directory; outside CI
+    there is no cache so nothing is written into the checkout.
+    """
+    runner_temp = os.environ.get('RUNNER_TEMP')
+    if not runner_temp:
+        return None
+    return Path(runner_temp) / 'coverage-comment-etag.json'
+
+
+def _load_etag_cache() -> dict:
+    """Load the ETag cache, returning an empty cache if missing or unreadable."""
+    cache_path = _etag_cache_path()
+    if cache_path is None:
+        return {}
+    try:
+        return json.loads(cache_path.read_text())
+    except (OSError, ValueError):
+        return {}
+
+
+def _save_etag_cache(cache: dict) -> None:
+    """Persist the ETag cache."""
+    cache_path = _etag_cache_path()
+    if cache_path is None:
+        return
+    try:
+        cache_path.write_text(json.dumps(cache))
+    except OSError as e:
+        print(f"Warning: Could not write ETag cache: {e}", file=sys.stderr)
+
+
+def _github_request(
+    conn: http.client.HTTPSConnection,
+    method: str,
+    url: str,
+    github_token: str,
+    body: dict | None = None,
+    extra_headers: dict[str, str] | None = None,
+) -> tuple[int, bytes, http.client.HTTPMessage]:
+    """Send a request to the GitHub API over an existing connection.
+
+    The response body is returned undecoded so it can be parsed directly.
+    """
+    headers = {
+        'Authorization': f'Bearer {github_token}',
+        'Accept': 'application/vnd.github+json',
+        'User-Agent': 'keystone-coverage-comment',
+        **(extra_headers or {}),
+    }
+    payload = None
+    if body is not None:
+        payload = json.dumps(body).encode()
+        headers['Content-Type'] = 'application/json'
+
+    conn.request(method, url, body=payload, headers=headers)
+    response = conn.getresponse()
+    return response.status, response.read(), response.headers
+
+
+def _body_hash(body: str) -> str:
+    """Return a stable fingerprint of a comment body."""
+    return hashlib.sha256(body.encode()).hexdigest()
+
+
+def _remember_posted_comment(pr_number: str, comment_id: int, body: str) -> None:
+    """Record a comment this run created or updated."""
+    cache = _load_etag_cache()
+    # The comment list changed, so the stored ETag is stale
+    cache[pr_number] = {'etag': None, 'comment_id': comment_id, 'body_hash': _body_hash(body)}
+    _save_etag_cache(cache)
+
+
+def _find_coverage_comment(
+    conn: http.client.HTTPSConnection, repository: str, pr_number: str, github_token: str
+) -> tuple[int | None, str | None]:
+    """Find the existing coverage comment and its body hash.
+
+    Uses a conditional request when a cached ETag is available.
+    """
+    cache = _load_etag_cache()
+    cached = cache.get(pr_number, {})
+
+    extra_headers = {'If-None-Match': cached['etag']} if cached.get('etag') else None
+    status, data, headers = _github_request(
+        conn, 'GET', f'/repos/{repository}/issues/{pr_number}/comments', github_token,
+        extra_headers=extra_headers
+    )
+
+    # Comments unchanged since the last run; reuse the cached result
+    if status == 304:
+        return cached.get('comment_id'), cached.get('body_hash')
+
+    if status != 200:
+        print(f"Error fetching comments: {status} {data.decode(errors='replace')}", file=sys.stderr)
+        sys.exit(1)
+
+    comment_id = body_hash = None
+    for comment in json_loads(data):
+        if comment['user']['login'] == 'github-actions[bot]' and '## Code Coverage Report' in comment['body']:
+            comment_id = comment['id']
+            body_hash = _body_hash(comment['body'])
+            break
+
+    if headers.get('ETag'):
+        cache[pr_number] = {'etag': headers['ETag'], 'comment_id': comment_id, 'body_hash': body_hash}
+        _save_etag_cache(cache)
+
+    return comment_id, body_hash
 
 
 def post_comment(pr_number: str, comment_body: str, github_token: str) -> None:
     """Post or update a comment on the PR."""
-    # Check for existing coverage comment
-    result = subprocess.run(
-        ['gh', 'api', f'repos/{{owner}}/{{repo}}/issues/{pr_number}/comments'],
-        capture_output=True,
-        text=True,
-        env={**os.environ, 'GH_TOKEN': github_token}
-    )
+    repository = os.environ.get('GITHUB_REPOSITORY')
+    if not repository:
+        print("Error: GITHUB_REPOSITORY environment variable required", file=sys.stderr)
+        sys.exit(1)
 
-    if result.returncode == 0:
-        comments = json.loads(result.stdout)
-        coverage_comment = None
+    # One connection is reused for the list and the update/create call; the timeout
+    # keeps a stalled socket from hanging the job
+    conn = http.client.HTTPSConnection('api.github.com', timeout=30)
+    try:
+        # Check for existing coverage comment
+        comment_id, body_hash = _find_coverage_comment(conn, repository, pr_number, github_token)
 
-        for comment in comments:
-            if comment['user']['login'] == 'github-actions[bot]' and '## Code Coverage Report' in comment['body']:
-                coverage_comment = comment
-                break
+        if comment_id and body_hash == _body_hash(comment_body):
+            # Leaving the comment untouched also keeps the cached ETag valid
+            print(f"Coverage comment is already up to date (ID: {comment_id})")
+            return
 
-        if coverage_comment:
+        if comment_id:
             # Update existing comment
-            subprocess.run(
-                ['gh', 'api', '-X', 'PATCH', f'repos/{{owner}}/{{repo}}/issues/comments/{coverage_comment["id"]}',
-                 '-f', f'body={comment_body}'],
-                env={**os.environ, 'GH_TOKEN': github_token},
-                check=True
-            )
-            print(f"Updated existing coverage comment (ID: {coverage_comment['id']})")
-        else:
-            # Create new comment
-            subprocess.run(
-                ['gh', 'api', '-X', 'POST', f'repos/{{owner}}/{{repo}}/issues/{pr_number}/comments',
-                 '-f', f'body={comment_body}'],
-                env={**os.environ, 'GH_TOKEN': github_token},
-                check=True
+            status, data, _ = _github_request(
+                conn, 'PATCH', f'/repos/{repository}/issues/comments/{comment_id}',
+                github_token, {'body': comment_body}
             )
-            print("Created new coverage comment")
-    else:
-        print(f"Error fetching comments: {result.stderr}", file=sys.stderr)
+            if status == 200:
+                _remember_posted_comment(pr_number, comment_id, comment_body)
+                print(f"Updated existing coverage comment (ID: {comment_id})")
+                return
+            if status != 404:
+                print(f"Error updating comment: {status} {data.decode(errors='replace')}", file=sys.stderr)
+                sys.exit(1)
+            # Cached comment was deleted; fall through and create a new one
+            print(f"Coverage comment {comment_id} no longer exists")
+
+        # Create new comment
+        status, data, _ = _github_request(
+            conn, 'POST', f'/repos/{repository}/issues/{pr_number}/comments',
+            github_token, {'body': comment_body}
+        )
+        if status != 201:
+            print(f"Error creating comment: {status} {data.decode(errors='replace')}", file=sys.stderr)
+            sys.exit(1)
+
+        _remember_posted_comment(pr_number, json_loads(data)['id'], comment_body)
+        print("Created new coverage comment")
+    except (OSError, http.client.HTTPException) as e:
+        print(f"Error communicating with GitHub: {e}", file=sys.stderr)
         sys.exit(1)
+    finally:
+        conn.close()
 
 
 def main() -> None:
@@ -4,7 +4,7 @@ from fastapi.testclient import TestClient
 from main import app
 
 
-@pytest.fixture
+@pytest.fixture(scope="session")
 def client() -> TestClient:
     return TestClient(app)
 
@@ -1,8 +1,14 @@
+import functools
 import os
+import re
 from pathlib import Path
 
 from playwright.sync_api import sync_playwright
 
+# Characters that are invalid in filenames, plus spaces
+_INVALID_FILENAME_CHARS = re.compile(r'[":<>|*?\r\n ]+')
+_UNDERSCORE_RUNS = re.compile(r"_{2,}")
+
 
 def before_all(context) -> None:
     """Setup before all tests."""
@@ -10,6 +16,8 @@ def before_all(context) -> None:
     # Set HEADLESS=false to see the browser
     headless = os.getenv("HEADLESS", "true").lower() == "true"
     context.browser = context.playwright.chromium.launch(headless=headless)
+    # Share one browser context across scenarios; each scenario gets its own page
+    context.browser_context = context.browser.new_context()
 
     # Create screenshots directory
     context.screenshots_dir = Path("screenshots")
@@ -18,13 +26,17 @@ def before_all(context) -> None:
 
 def after_all(context) -> None:
     """Cleanup after all tests."""
+    context.browser_context.close()
     context.browser.close()
     context.playwright.stop()
 
 
 def before_scenario(context, scenario) -> None:
     """Setup before each scenario."""
-    context.page = context.browser.new_page()
+    # Cookies are reset here and web storage in after_scenario; the HTTP cache
+    # is still shared across scenarios
+    context.browser_context.clear_cookies()
+    context.page = context.browser_context.new_page()
     context.scenario_name = scenario.name
 
 
@@ -32,25 +44,29 @@ def after_scenario(context, scenario) -> None:
     """Cleanup after each scenario."""
     # Take screenshot on failure
     if scenario.status == "failed":
-        screenshot_name = f"{_sanitize_filename(context.scenario_name)}_FAILED.png"
+        screenshot_name = f"{_sanitize_filename(context.scenario_name)}_FAILED.jpg"
         screenshot_path = context.screenshots_dir / screenshot_name
-        context.page.screenshot(path=str(screenshot_path))
+        _save_screenshot(context.page, screenshot_path)
         print(f"Screenshot saved: {screenshot_path}")
 
+    # Storage is per origin, so clear it while the page is still on the app
+    if context.page.url.startswith("http"):
+        context.page.evaluate("() => { localStorage.clear(); sessionStorage.clear(); }")
     context.page.close()
 
 
+def _save_screenshot(page, path: Path) -> None:
+    """Capture the viewport as a JPEG sized for embedding in the PDF report."""
+    page.screenshot(path=str(path), type="jpeg", quality=70, full_page=False)
+
+
+@functools.lru_cache(maxsize=4096)
 def _sanitize_filename(name: str) -> str:
     """Sanitize filename by removing invalid characters."""
-    # Replace invalid characters with underscores
-    invalid_chars = '":<>|*?\r\n'
-    for char in invalid_chars:
-        name = name.replace(char, "_")
-    # Replace spaces with underscores and collapse multiple underscores
-    name = name.replace(" ", "_")
-    while "__" in name:
-        name = name.replace("__", "_")
-    return name
+    # Replace runs of invalid characters and spaces with a single underscore
+    name = _INVALID_FILENAME_CHARS.sub("_", name)
+    # Collapse multiple underscores
+    return _UNDERSCORE_RUNS.sub("_", name)
 
 
 def after_step(context, step) -> None:
@@ -68,7 +84,7 @@ def after_step(context, step) -> None:
     if should_screenshot:
         # Save to screenshots directory
         step_name = f"{context.scenario_name}_{step.keyword.strip()}_{step.name}"
-        screenshot_name = f"{_sanitize_filename(step_name)}.png"
+        screenshot_name = f"{_sanitize_filename(step_name)}.jpg"
         screenshot_path = context.screenshots_dir / screenshot_name
-        context.page.screenshot(path=str(screenshot_path))
+        _save_screenshot(context.page, screenshot_path)
         print(f"Step screenshot saved: {screenshot_path}")
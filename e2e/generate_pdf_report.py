@@ -6,7 +6,9 @@ Parses behave JSON results and embeds screenshots to create a
 professional PDF report suitable for change management approval.
 """
 
-import json
+import functools
+import io
+import re
 import sys
 from datetime import UTC, datetime
 from pathlib import Path
@@ -26,12 +28,23 @@ from reportlab.platypus import (
     TableStyle,
 )
 
+# orjson is optional; the stdlib parser is used when it is not installed
+try:
+    from orjson import loads as json_loads
+except ImportError:
+    from json import loads as json_loads
+
+# Characters that are invalid in filenames, plus spaces
+_INVALID_FILENAME_CHARS = re.compile(r'[":<>|*?\r\n ]+')
+_UNDERSCORE_RUNS = re.compile(r"_{2,}")
+
 
 class TestReportGenerator:
     def __init__(self, json_path: Path, screenshots_dir: Path, output_path: Path):
         self.json_path = json_path
         self.screenshots_dir = screenshots_dir
         self.output_path = output_path
+        self._screenshot_index = self._index_screenshots()
         self.styles = getSampleStyleSheet()
         self._setup_custom_styles()
         self.story = []
@@ -77,8 +90,11 @@ class TestReportGenerator:
             )
         )
 
-    def _add_title_page(self, data: dict[str, Any]) -> None:
-        """Add title page with test summary."""
+    def _add_title_page(self, scenario_results: list[bool]) -> None:
+        """Add title page with test summary.
+
+        ``scenario_results`` holds one passed/failed flag per scenario.
+        """
         self.story.append(Spacer(1, 2 * inch))
         self.story.append(Paragraph("End-to-End Test Report", self.styles["CustomTitle"]))
         self.story.append(Spacer(1, 0.5 * inch))
@@ -108,12 +124,8 @@ class TestReportGenerator:
         self.story.append(Spacer(1, 0.5 * inch))
 
         # Test summary
-        total_scenarios = len(data[0]["elements"])
-        passed_scenarios = sum(
-            1
-            for scenario in data[0]["elements"]
-            if all(step["result"]["status"] == "passed" for step in scenario["steps"])
-        )
+        total_scenarios = len(scenario_results)
+        passed_scenarios = sum(scenario_results)
         failed_scenarios = total_scenarios - passed_scenarios
 
         summary = [
@@ -145,17 +157,29 @@ class TestReportGenerator:
         self.story.append(summary_table)
         self.story.append(PageBreak())
 
-    def _sanitize_filename(self, name: str) -> str:
+    @staticmethod
+    @functools.lru_cache(maxsize=4096)
+    def _sanitize_filename(name: str) -> str:
         """Sanitize filename by removing invalid characters."""
-        # Replace invalid characters with underscores
-        invalid_chars = '":<>|*?\r\n'
-        for char in invalid_chars:
-            name = name.replace(char, "_")
-        # Replace spaces with underscores and collapse multiple underscores
-        name = name.replace(" ", "_")
-        while "__" in name:
-            name = name.replace("__", "_")
-        return name
+        # Replace runs of invalid characters and spaces with a single underscore
+        name = _INVALID_FILENAME_CHARS.sub("_", name)
+        # Collapse multiple underscores
+        return _UNDERSCORE_RUNS.sub("_", name)
+
+    def _index_screenshots(self) -> dict[str, Path]:
+        """Map screenshot filename stems to their paths with a single directory scan."""
+        if not self.screenshots_dir.is_dir():
+            return {}
+
+        # Earlier extensions take precedence when a stem exists in several formats
+        extensions = [".jpg", ".jpeg", ".png"]
+        index: dict[str, Path] = {}
+        for path in sorted(
+            (p for p in self.screenshots_dir.iterdir() if p.suffix in extensions),
+            key=lambda p: extensions.index(p.suffix),
+        ):
+            index.setdefault(path.stem, path)
+        return index
 
     def _find_screenshot(
         self, scenario_name: str, step_keyword: str, step_name: str
@@ -163,13 +187,14 @@ class TestReportGenerator:
         """Find screenshot for a step."""
         # Match the naming pattern from environment.py
         step_screenshot = f"{scenario_name}_{step_keyword}_{step_name}"
-        sanitized = self._sanitize_filename(step_screenshot)
-
-        for ext in [".png", ".jpg", ".jpeg"]:
-            screenshot_path = self.screenshots_dir / f"{sanitized}{ext}"
-            if screenshot_path.exists():
-                return screenshot_path
-
+        return self._screenshot_index.get(self._sanitize_filename(step_screenshot))
+
+    def _step_screenshot(self, scenario_name: str, step: dict[str, Any]) -> Path | None:
+        """Return the screenshot to embed for a step, if any."""
+        keyword = step["keyword"].strip()
+        # Only "Then" steps and failures get screenshots in the report
+        if keyword.lower() == "then" or step["result"]["status"] == "failed":
+            return self._find_screenshot(scenario_name, keyword, step["name"])
         return None
 
     def _add_scenario(self, scenario: dict[str, Any]) -> None:
@@ -183,7 +208,8 @@ class TestReportGenerator:
             self.story.append(Paragraph(scenario["description"], self.styles["Normal"]))
             self.story.append(Spacer(1, 0.1 * inch))
 
-        # Steps
+        # Steps; consecutive step lines share one paragraph until a screenshot or error
+        step_lines: list[str] = []
         for step in scenario["steps"]:
             keyword = step["keyword"].strip()
             name = step["name"]
@@ -192,24 +218,25 @@ class TestReportGenerator:
             # Step text with status indicator
             status_color = colors.green if status == "passed" else colors.red
             step_text = f'<font color="{status_color.hexval()}">●</font> {keyword} {name}'
-            self.story.append(Paragraph(step_text, self.styles["StepText"]))
+            step_lines.append(step_text)
 
             # Add screenshot if it exists for "Then" steps or failures
-            if keyword.lower() == "then" or status == "failed":
-                screenshot_path = self._find_screenshot(scenario_name, keyword, name)
-                if screenshot_path and screenshot_path.exists():
+            screenshot_path = self._step_screenshot(scenario_name, step)
+            if screenshot_path:
+                self._flush_step_lines(step_lines)
+                self.story.append(Spacer(1, 0.1 * inch))
+                try:
+                    # Resize image to fit page width
+                    img = Image(str(screenshot_path), width=5.5 * inch, height=3.5 * inch)
+                    img.hAlign = "LEFT"
+                    self.story.append(img)
                     self.story.append(Spacer(1, 0.1 * inch))
-                    try:
-                        # Resize image to fit page width
-                        img = Image(str(screenshot_path), width=5.5 * inch, height=3.5 * inch)
-                        img.hAlign = "LEFT"
-                        self.story.append(img)
-                        self.story.append(Spacer(1, 0.1 * inch))
-                    except Exception as e:
-                        print(f"Warning: Could not embed screenshot {screenshot_path}: {e}")
+                except Exception as e:
+                    print(f"Warning: Could not embed screenshot {screenshot_path}: {e}")
 
             # Show error message if failed
             if status == "failed" and "error_message" in step["result"]:
+                self._flush_step_lines(step_lines)
                 error_style = ParagraphStyle(
                     name="Error",
                     parent=self.styles["Normal"],
@@ -221,8 +248,15 @@ class TestReportGenerator:
                 error_text = step["result"]["error_message"][:500]  # Truncate long errors
                 self.story.append(Paragraph(f"<b>Error:</b> {error_text}", error_style))
 
+        self._flush_step_lines(step_lines)
         self.story.append(Spacer(1, 0.3 * inch))
 
+    def _flush_step_lines(self, step_lines: list[str]) -> None:
+        """Add buffered step lines as a single paragraph and clear the buffer."""
+        if step_lines:
+            self.story.append(Paragraph("<br/>".join(step_lines), self.styles["StepText"]))
+            step_lines.clear()
+
     def _add_approval_section(self) -> None:
         """Add change management approval section."""
         self.story.append(PageBreak())
@@ -267,12 +301,12 @@ class TestReportGenerator:
     def generate(self) -> None:
         """Generate the PDF report."""
         # Load test results
-        with Path(self.json_path).open() as f:
-            data = json.load(f)
+        data = json_loads(Path(self.json_path).read_bytes())
 
-        # Create PDF
+        # Create PDF in memory; it is written to disk in one go once built
+        buffer = io.BytesIO()
         doc = SimpleDocTemplate(
-            str(self.output_path),
+            buffer,
             pagesize=letter,
             rightMargin=0.75 * inch,
             leftMargin=0.75 * inch,
@@ -280,11 +314,17 @@ class TestReportGenerator:
             bottomMargin=0.75 * inch,
         )
 
+        # Determine each scenario's outcome once for the summary
+        feature = data[0]
+        scenario_results = [
+            all(step["result"]["status"] == "passed" for step in scenario["steps"])
+            for scenario in feature["elements"]
+        ]
+
         # Build content
-        self._add_title_page(data)
+        self._add_title_page(scenario_results)
 
         # Add feature description
-        feature = data[0]
         self.story.append(Paragraph(f"Feature: {feature['name']}", self.styles["SectionHeader"]))
         if feature.get("description"):
             # Description can be a list or string
@@ -303,6 +343,7 @@ class TestReportGenerator:
 
         # Generate PDF
         doc.build(self.story)
+        self.output_path.write_bytes(buffer.getvalue())
         print(f"PDF report generated: {self.output_path}")
 
 